@@ -1,15 +1,25 @@
 import streamlit as st
-import plotly.express as px
+import plotly.graph_objects as go
 from datetime import datetime, date
 import json
 import os
 import hashlib
+import hmac
 import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from modelos import Escola, Produto, Cliente, Pedido
 
 # Tentar importar psycopg2 com fallback
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    import psycopg2.pool
+    from psycopg2.errors import CheckViolation
+    from psycopg2.extras import execute_values
     PSYCOPG2_AVAILABLE = True
 except ImportError as e:
     st.error(f"Erro ao importar psycopg2: {e}")
@@ -23,12 +33,28 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Conexão com PostgreSQL - Versão mais robusta
+# Quantidade de registros por página nas listagens
+PAGE_SIZE = 50
+
+# Tamanhos disponíveis para estoque e pedidos
+TAMANHOS = ('2', '4', '6', '8', '10', '12', 'pp', 'p', 'm', 'g', 'gg')
+
+# Validade (segundos) das consultas em cache; escritas limpam os caches afetados na hora
+CACHE_TTL = 60
+
+# Limites do pool de conexões (tempo de espera em segundos por uma conexão livre)
+POOL_MIN_CONN = 2
+POOL_MAX_CONN = 10
+POOL_TIMEOUT = 10
+# Conexões ociosas há mais que isso (segundos) são testadas com SELECT 1 antes do uso
+POOL_PING_APOS = 30
+
+# Pool de conexões com PostgreSQL - sessões simultâneas não disputam a mesma conexão
 @st.cache_resource
-def init_connection():
+def init_pool():
+    """Cria o pool; falhas levantam exceção para que o st.cache_resource não guarde um pool ausente"""
     if not PSYCOPG2_AVAILABLE:
-        st.error("psycopg2 não está disponível. Verifique as dependências.")
-        return None
+        raise RuntimeError("psycopg2 não está disponível. Verifique as dependências.")
         
     try:
         # Primeiro tenta variáveis de ambiente do Render
@@ -55,34 +81,126 @@ def init_connection():
         
         # Verifica se todas as configurações estão presentes
         if not all(db_config.values()):
-            st.error("Configuração do banco de dados incompleta.")
-            return None
+            raise RuntimeError("Configuração do banco de dados incompleta.")
             
-        conn = psycopg2.connect(**db_config)
-        return conn
+        # Keepalives fazem o sistema operacional detectar conexões ociosas derrubadas pelo servidor
+        return psycopg2.pool.ThreadedConnectionPool(
+            POOL_MIN_CONN, POOL_MAX_CONN, **db_config,
+            connect_timeout=POOL_TIMEOUT, keepalives=1, keepalives_idle=60,
+            keepalives_interval=10, keepalives_count=3
+        )
         
     except Exception as e:
-        st.error(f"❌ Erro ao conectar com PostgreSQL: {e}")
-        return None
+        raise RuntimeError(f"❌ Erro ao conectar com PostgreSQL: {e}") from e
+
+# O ThreadedConnectionPool falha na hora quando esgotado; o semáforo faz as sessões aguardarem
+@st.cache_resource
+def init_pool_slots():
+    return threading.BoundedSemaphore(POOL_MAX_CONN)
+
+# Conexões do pool que já receberam o PREPARE; conexões descartadas saem sozinhas do conjunto
+@st.cache_resource
+def init_conexoes_preparadas():
+    return weakref.WeakSet()
+
+# Momento em que cada conexão voltou ao pool; conexões descartadas saem sozinhas
+@st.cache_resource
+def init_ultimo_uso():
+    return weakref.WeakKeyDictionary()
 
-# Inicialização condicional
+# Trava e momento (monotonic) do início do último REFRESH da view de faturamento mensal
+@st.cache_resource
+def init_refresh_faturamento():
+    return {'lock': threading.Lock(), 'ultimo': 0.0}
+
+# Inicialização condicional; sem pool em cache, o próximo rerun tenta conectar de novo
+pool = None
 if PSYCOPG2_AVAILABLE:
-    conn = init_connection()
-else:
-    conn = None
+    try:
+        pool = init_pool()
+    except RuntimeError as e:
+        st.error(str(e))
+    pool_slots = init_pool_slots()
+    conexoes_preparadas = init_conexoes_preparadas()
+    ultimo_uso = init_ultimo_uso()
+    refresh_faturamento = init_refresh_faturamento()
+
+def _conexao_ativa(conn):
+    """Pré-ping: testa com SELECT 1 as conexões ociosas há mais de POOL_PING_APOS segundos"""
+    if conn.closed:
+        return False
+    if time.monotonic() - ultimo_uso.get(conn, 0.0) < POOL_PING_APOS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+@contextmanager
+def get_conn():
+    """Empresta uma conexão do pool e a devolve ao final, desfazendo transações não confirmadas"""
+    if not pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("Nenhuma conexão livre no pool")
+    try:
+        for _ in range(POOL_MAX_CONN):
+            conn = pool.getconn()
+            if _conexao_ativa(conn):
+                break
+            # Conexão derrubada pelo servidor enquanto ociosa: descarta e pega outra
+            pool.putconn(conn, close=True)
+        else:
+            raise psycopg2.OperationalError("Não foi possível obter uma conexão válida com o banco")
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Conexão possivelmente quebrada não volta para o pool
+            conn.close()
+            raise
+        finally:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+            if not conn.closed:
+                ultimo_uso[conn] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        pool_slots.release()
+
+@contextmanager
+def db_tx():
+    """Abre uma transação para várias escritas: confirma ao final ou desfaz tudo em caso de erro"""
+    with get_conn() as conn, conn:
+        with conn.cursor() as cur:
+            yield cur
 
 # Sistema de Autenticação
+password_hasher = PasswordHasher()
+
 def make_hashes(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
+    return password_hasher.hash(password)
 
 def check_hashes(password, hashed_text):
-    return make_hashes(password) == hashed_text
+    # Senhas antigas (SHA-256 sem salt) ainda são aceitas e migradas no próximo login
+    if not hashed_text.startswith('$argon2'):
+        return hmac.compare_digest(hashlib.sha256(password.encode('utf-8')).hexdigest(), hashed_text)
+    try:
+        return password_hasher.verify(hashed_text, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def needs_rehash(hashed_text):
+    return not hashed_text.startswith('$argon2') or password_hasher.check_needs_rehash(hashed_text)
 
 def create_usertable():
-    if not conn:
+    if not pool:
         return False
     try:
-        with conn.cursor() as cur:
+        with get_conn() as conn, conn.cursor() as cur:
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS usuarios (
                     id SERIAL PRIMARY KEY,
@@ -99,10 +217,10 @@ def create_usertable():
         return False
 
 def add_user(username, password, nivel='Vendedor'):
-    if not conn:
+    if not pool:
         return False
     try:
-        with conn.cursor() as cur:
+        with get_conn() as conn, conn.cursor() as cur:
             cur.execute(
                 "INSERT INTO usuarios (username, password, nivel) VALUES (%s, %s, %s)",
                 (username, make_hashes(password), nivel)
@@ -114,14 +232,22 @@ def add_user(username, password, nivel='Vendedor'):
         return False
 
 def login_user(username, password):
-    if not conn:
+    if not pool:
         return None
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM usuarios WHERE username = %s", (username,))
-            user = cur.fetchone()
-            if user and check_hashes(password, user['password']):
-                return user
+        with get_conn() as conn, conn.cursor() as cur:
+            # Só as colunas usadas; o hash não sai desta função nem vai para a sessão
+            cur.execute("SELECT id, username, password, nivel FROM usuarios WHERE username = %s", (username,))
+            row = cur.fetchone()
+            if row and check_hashes(password, row[2]):
+                user_id, nome, hash_senha, nivel = row
+                if needs_rehash(hash_senha):
+                    cur.execute(
+                        "UPDATE usuarios SET password = %s WHERE id = %s",
+                        (make_hashes(password), user_id)
+                    )
+                    conn.commit()
+                return {'id': user_id, 'username': nome, 'nivel': nivel}
             return None
     except Exception as e:
         st.error(f"Erro no login: {e}")
@@ -129,11 +255,11 @@ def login_user(username, password):
 
 # Inicialização do banco de dados
 def init_db():
-    if not conn:
+    if not pool:
         return False
         
     try:
-        with conn.cursor() as cur:
+        with get_conn() as conn, conn.cursor() as cur:
             # Tabela de escolas
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS escolas (
@@ -179,11 +305,21 @@ def init_db():
                     escola_id INTEGER REFERENCES escolas(id),
                     produto_id INTEGER REFERENCES produtos(id),
                     tamanho VARCHAR(5) NOT NULL,
-                    quantidade INTEGER DEFAULT 0,
+                    quantidade INTEGER DEFAULT 0 CHECK (quantidade >= 0),
                     UNIQUE(escola_id, produto_id, tamanho)
                 )
             """)
             
+            # Bancos criados antes da restrição: vale para novas alterações sem revalidar linhas antigas
+            cur.execute("""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'estoque_quantidade_check') THEN
+                        ALTER TABLE estoque ADD CONSTRAINT estoque_quantidade_check CHECK (quantidade >= 0) NOT VALID;
+                    END IF;
+                END $$;
+            """)
+            
             # Tabela de pedidos
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS pedidos (
@@ -210,6 +346,30 @@ def init_db():
                 )
             """)
             
+            # Índices para as chaves estrangeiras e filtros usados em JOINs/WHERE.
+            # Filtros por escola no estoque usam o índice de UNIQUE(escola_id, produto_id, tamanho).
+            # O índice de itens por produto inclui a quantidade para o Top Produtos ler só o índice.
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_estoque_produto ON estoque(produto_id);
+                CREATE INDEX IF NOT EXISTS idx_clientes_escola ON clientes(escola_id);
+                CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome);
+                CREATE INDEX IF NOT EXISTS idx_itens_pedido_pedido ON itens_pedido(pedido_id);
+                CREATE INDEX IF NOT EXISTS idx_itens_pedido_produto_qtd ON itens_pedido(produto_id) INCLUDE (quantidade);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_cliente ON pedidos(cliente_id);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_escola ON pedidos(escola_id);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_status_partial ON pedidos(status) WHERE status = 'Pendente';
+                CREATE INDEX IF NOT EXISTS idx_pedidos_data ON pedidos(data_pedido);
+            """)
+            
+            # Faturamento mensal pré-agregado para o dashboard; o índice único permite REFRESH CONCURRENTLY
+            cur.execute("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS faturamento_mensal AS
+                SELECT DATE_TRUNC('month', data_pedido)::date AS mes, COALESCE(SUM(total), 0) AS total
+                FROM pedidos
+                GROUP BY 1;
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_faturamento_mensal_mes ON faturamento_mensal(mes);
+            """)
+            
             conn.commit()
             return True
             
@@ -217,212 +377,494 @@ def init_db():
         st.error(f"❌ Erro ao criar tabelas: {e}")
         return False
 
+def _seed_admin():
+    """Cria o usuário admin padrão se não existir"""
+    try:
+        # Verificação e inserção em uma única instrução
+        with db_tx() as cur:
+            cur.execute("""
+                INSERT INTO usuarios (username, password, nivel)
+                SELECT %s, %s, %s
+                WHERE NOT EXISTS (SELECT 1 FROM usuarios WHERE username = %s)
+            """, ('admin', make_hashes('admin123'), 'Admin', 'admin'))
+        return True
+    except Exception as e:
+        st.error(f"Erro ao criar usuário admin: {e}")
+        return False
+
+# Tabelas e usuário admin são preparados uma única vez por processo,
+# não a cada rerun do Streamlit
+@st.cache_resource
+def _ensure_schema():
+    if not (create_usertable() and init_db() and _seed_admin()):
+        # Levantar evita que st.cache_resource guarde a falha; o próximo rerun tenta de novo
+        raise RuntimeError("Falha ao preparar o banco de dados")
+    return True
+
 # Inicializar banco se conectado
-if conn:
-    create_usertable()
-    init_db()
+if pool:
+    try:
+        _ensure_schema()
+    except RuntimeError:
+        pass  # O motivo já foi exibido pela etapa que falhou
 
 # Funções do Sistema
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
 def get_escolas():
-    if not conn:
-        return []
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM escolas ORDER BY nome")
-            return cur.fetchall()
-    except Exception as e:
-        st.error(f"Erro ao buscar escolas: {e}")
+    if not pool:
         return []
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, nome, telefone, email, endereco FROM escolas ORDER BY nome")
+        return [Escola(*row) for row in cur.fetchall()]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_escolas_index():
+    """Escolas e a tupla de nomes (mesma ordem) usada nos seletores dos formulários"""
+    escolas = get_escolas()
+    return escolas, tuple(e.nome for e in escolas)
 
 def add_escola(nome, telefone, email, endereco):
-    if not conn:
+    if not pool:
         return False
     try:
-        with conn.cursor() as cur:
+        with db_tx() as cur:
             cur.execute(
                 "INSERT INTO escolas (nome, telefone, email, endereco) VALUES (%s, %s, %s, %s)",
                 (nome, telefone, email, endereco)
             )
-            conn.commit()
-            return True
+        get_escolas.clear()
+        get_escolas_index.clear()
+        get_dashboard_metricas.clear()
+        return True
     except Exception as e:
         st.error(f"Erro ao adicionar escola: {e}")
         return False
 
-def get_clientes():
-    if not conn:
-        return []
+def add_escolas_bulk(rows):
+    """Cadastra várias escolas de uma vez; rows = [(nome, telefone, email, endereco), ...]"""
+    if not pool:
+        return False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT c.*, e.nome as escola_nome 
-                FROM clientes c 
-                LEFT JOIN escolas e ON c.escola_id = e.id 
-                ORDER BY c.nome
-            """)
-            return cur.fetchall()
+        with db_tx() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO escolas (nome, telefone, email, endereco) VALUES %s",
+                rows,
+                page_size=1000
+            )
+        get_escolas.clear()
+        get_escolas_index.clear()
+        get_dashboard_metricas.clear()
+        return True
     except Exception as e:
-        st.error(f"Erro ao buscar clientes: {e}")
+        st.error(f"Erro ao importar escolas: {e}")
+        return False
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_clientes(limit=None, offset=0):
+    if not pool:
         return []
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.id, c.nome, c.telefone, c.email, c.cpf, c.endereco, e.nome as escola_nome 
+            FROM clientes c 
+            LEFT JOIN escolas e ON c.escola_id = e.id 
+            ORDER BY c.nome, c.id
+            LIMIT %s OFFSET %s
+        """, (limit, offset))
+        return [Cliente(*row) for row in cur.fetchall()]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_clientes_index():
+    """Clientes e a tupla de nomes (mesma ordem) usada nos seletores dos formulários"""
+    clientes = get_clientes()
+    return clientes, tuple(c.nome for c in clientes)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_total_clientes():
+    if not pool:
+        return 0
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM clientes")
+        return cur.fetchone()[0]
 
 def add_cliente(nome, telefone, email, cpf, endereco, escola_id):
-    if not conn:
+    if not pool:
         return False
     try:
-        with conn.cursor() as cur:
+        with db_tx() as cur:
             cur.execute(
                 """INSERT INTO clientes (nome, telefone, email, cpf, endereco, escola_id) 
                 VALUES (%s, %s, %s, %s, %s, %s)""",
                 (nome, telefone, email, cpf, endereco, escola_id)
             )
-            conn.commit()
-            return True
+        get_clientes.clear()
+        get_clientes_index.clear()
+        get_total_clientes.clear()
+        get_dashboard_metricas.clear()
+        return True
     except Exception as e:
         st.error(f"Erro ao adicionar cliente: {e}")
         return False
 
-def get_produtos():
-    if not conn:
-        return []
+def add_clientes_bulk(rows):
+    """Cadastra vários clientes de uma vez; rows = [(nome, telefone, email, cpf, endereco, escola_id), ...]"""
+    if not pool:
+        return False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM produtos ORDER BY nome")
-            return cur.fetchall()
+        with db_tx() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO clientes (nome, telefone, email, cpf, endereco, escola_id) VALUES %s",
+                rows,
+                page_size=1000
+            )
+        get_clientes.clear()
+        get_clientes_index.clear()
+        get_total_clientes.clear()
+        get_dashboard_metricas.clear()
+        return True
     except Exception as e:
-        st.error(f"Erro ao buscar produtos: {e}")
+        st.error(f"Erro ao importar clientes: {e}")
+        return False
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_produtos():
+    if not pool:
         return []
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, nome, preco_venda FROM produtos ORDER BY nome")
+        return [Produto(*row) for row in cur.fetchall()]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_produtos_index():
+    """Produtos e a tupla de nomes (mesma ordem) usada nos seletores dos formulários"""
+    produtos = get_produtos()
+    return produtos, tuple(p.nome for p in produtos)
 
 def add_produto(nome, descricao, preco_custo, preco_venda):
-    if not conn:
+    if not pool:
         return False
     try:
-        with conn.cursor() as cur:
+        with db_tx() as cur:
             cur.execute(
                 """INSERT INTO produtos (nome, descricao, preco_custo, preco_venda) 
                 VALUES (%s, %s, %s, %s)""",
                 (nome, descricao, preco_custo, preco_venda)
             )
-            conn.commit()
-            return True
+        get_produtos.clear()
+        get_produtos_index.clear()
+        return True
     except Exception as e:
         st.error(f"Erro ao adicionar produto: {e}")
         return False
 
-def get_estoque(escola_id=None):
-    if not conn:
-        return []
+def add_produtos_bulk(rows):
+    """Cadastra vários produtos de uma vez; rows = [(nome, descricao, preco_custo, preco_venda), ...]"""
+    if not pool:
+        return False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            if escola_id:
-                cur.execute("""
-                    SELECT e.*, p.nome as produto_nome, p.preco_venda, esc.nome as escola_nome
-                    FROM estoque e
-                    JOIN produtos p ON e.produto_id = p.id
-                    JOIN escolas esc ON e.escola_id = esc.id
-                    WHERE e.escola_id = %s
-                    ORDER BY p.nome, e.tamanho
-                """, (escola_id,))
-            else:
-                cur.execute("""
-                    SELECT e.*, p.nome as produto_nome, p.preco_venda, esc.nome as escola_nome
-                    FROM estoque e
-                    JOIN produtos p ON e.produto_id = p.id
-                    JOIN escolas esc ON e.escola_id = esc.id
-                    ORDER BY esc.nome, p.nome, e.tamanho
-                """)
-            return cur.fetchall()
+        with db_tx() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO produtos (nome, descricao, preco_custo, preco_venda) VALUES %s",
+                rows,
+                page_size=1000
+            )
+        get_produtos.clear()
+        get_produtos_index.clear()
+        return True
     except Exception as e:
-        st.error(f"Erro ao buscar estoque: {e}")
+        st.error(f"Erro ao importar produtos: {e}")
+        return False
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_estoque(escola_id=None, limit=None, offset=0):
+    """Estoque agrupado por escola no banco; cada linha é (escola_nome, itens)"""
+    if not pool:
         return []
+    with get_conn() as conn, conn.cursor() as cur:
+        # json (e não jsonb) preserva a ordem das colunas na tabela
+        cur.execute("""
+            SELECT esc.nome as escola_nome,
+                   json_agg(json_build_object(
+                       'Produto', p.nome,
+                       'Tamanho', e.tamanho,
+                       'Preço', COALESCE(p.preco_venda, 0),
+                       'Quantidade', e.quantidade,
+                       'Situação', CASE WHEN e.quantidade = 0 THEN '🔴 Esgotado'
+                                        WHEN e.quantidade < 10 THEN '🟠 Baixo'
+                                        ELSE '🟢 OK' END
+                   ) ORDER BY p.nome, e.tamanho) as itens
+            FROM estoque e
+            JOIN produtos p ON e.produto_id = p.id
+            JOIN escolas esc ON e.escola_id = esc.id
+            WHERE %(escola_id)s::int IS NULL OR e.escola_id = %(escola_id)s::int
+            GROUP BY esc.id, esc.nome
+            ORDER BY esc.nome, esc.id
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {'escola_id': escola_id, 'limit': limit, 'offset': offset})
+        return cur.fetchall()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_total_estoque(escola_id=None):
+    if not pool:
+        return 0
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(DISTINCT e.escola_id)
+            FROM estoque e
+            JOIN produtos p ON e.produto_id = p.id
+            WHERE %(escola_id)s::int IS NULL OR e.escola_id = %(escola_id)s::int
+        """, {'escola_id': escola_id})
+        return cur.fetchone()[0]
 
-def update_estoque(escola_id, produto_id, tamanho, quantidade):
-    if not conn:
+def update_estoque(rows):
+    """Define a quantidade em estoque; rows = [(escola_id, produto_id, tamanho, quantidade), ...]"""
+    if not pool:
         return False
+    # Um mesmo item não pode aparecer duas vezes no upsert; vale a última quantidade informada
+    ultimas = {}
+    for escola_id, produto_id, tamanho, quantidade in rows:
+        ultimas[(escola_id, produto_id, tamanho)] = quantidade
+    rows = [(*chave, quantidade) for chave, quantidade in ultimas.items()]
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
+        with db_tx() as cur:
+            execute_values(cur, """
                 INSERT INTO estoque (escola_id, produto_id, tamanho, quantidade) 
-                VALUES (%s, %s, %s, %s)
+                VALUES %s
                 ON CONFLICT (escola_id, produto_id, tamanho) 
-                DO UPDATE SET quantidade = %s
-            """, (escola_id, produto_id, tamanho, quantidade, quantidade))
-            conn.commit()
-            return True
+                DO UPDATE SET quantidade = EXCLUDED.quantidade
+            """, rows)
+        get_estoque.clear()
+        get_relatorios.clear()
+        get_total_estoque.clear()
+        return True
     except Exception as e:
         st.error(f"Erro ao atualizar estoque: {e}")
         return False
 
+def atualizar_faturamento_mensal():
+    """Recalcula a view do faturamento mensal; chamar depois que a escrita em pedidos já confirmou"""
+    confirmado_em = time.monotonic()
+    with refresh_faturamento['lock']:
+        # Um REFRESH iniciado depois da confirmação já enxerga esta escrita
+        if refresh_faturamento['ultimo'] >= confirmado_em:
+            return
+        inicio = time.monotonic()
+        try:
+            with db_tx() as cur:
+                cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY faturamento_mensal")
+        except Exception as e:
+            st.warning(f"Não foi possível atualizar o faturamento mensal: {e}")
+            return
+        refresh_faturamento['ultimo'] = inicio
+
+class EstoqueInsuficiente(Exception):
+    """Algum item do pedido não tem estoque cadastrado na escola"""
+
 def criar_pedido(cliente_id, escola_id, itens, desconto=0):
-    if not conn:
+    if not pool:
+        return None
+    if not itens:
+        st.error("O pedido precisa ter ao menos um item")
         return None
     try:
-        with conn.cursor() as cur:
+        # A transação confirma ao final ou desfaz o pedido inteiro em caso de erro
+        with db_tx() as cur:
             # Calcula total
             total = sum(item['quantidade'] * item['preco_unitario'] for item in itens) - desconto
             
-            # Cria pedido
-            cur.execute("""
-                INSERT INTO pedidos (cliente_id, escola_id, total, desconto) 
-                VALUES (%s, %s, %s, %s) RETURNING id
-            """, (cliente_id, escola_id, total, desconto))
-            pedido_id = cur.fetchone()[0]
-            
-            # Adiciona itens
+            # Pedido, itens e baixa de estoque em uma única instrução (itens repetidos são somados na baixa)
+            linhas = ", ".join(["(%s, %s, %s, %s)"] * len(itens))
+            params = [cliente_id, escola_id, total, desconto]
             for item in itens:
-                cur.execute("""
+                params += [item['produto_id'], item['tamanho'], item['quantidade'], item['preco_unitario']]
+            params.append(escola_id)
+            cur.execute(f"""
+                WITH novo_pedido AS (
+                    INSERT INTO pedidos (cliente_id, escola_id, total, desconto) 
+                    VALUES (%s, %s, %s, %s) RETURNING id
+                ), itens (produto_id, tamanho, quantidade, preco_unitario) AS (
+                    VALUES {linhas}
+                ), novos_itens AS (
                     INSERT INTO itens_pedido (pedido_id, produto_id, tamanho, quantidade, preco_unitario)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (pedido_id, item['produto_id'], item['tamanho'], item['quantidade'], item['preco_unitario']))
-                
-                # Atualiza estoque
-                cur.execute("""
-                    UPDATE estoque 
-                    SET quantidade = quantidade - %s 
-                    WHERE escola_id = %s AND produto_id = %s AND tamanho = %s
-                """, (item['quantidade'], escola_id, item['produto_id'], item['tamanho']))
-            
-            conn.commit()
-            return pedido_id
+                    SELECT np.id, i.produto_id, i.tamanho, i.quantidade, i.preco_unitario
+                    FROM novo_pedido np, itens i
+                ), baixa AS (
+                    UPDATE estoque e
+                    SET quantidade = e.quantidade - b.quantidade
+                    FROM (
+                        SELECT produto_id, tamanho, SUM(quantidade) AS quantidade
+                        FROM itens
+                        GROUP BY produto_id, tamanho
+                    ) AS b
+                    WHERE e.escola_id = %s AND e.produto_id = b.produto_id AND e.tamanho = b.tamanho
+                    RETURNING 1
+                )
+                SELECT id,
+                       (SELECT COUNT(*) FROM baixa) = (SELECT COUNT(DISTINCT (produto_id, tamanho)) FROM itens)
+                FROM novo_pedido
+            """, params)
+            pedido_id, estoque_ok = cur.fetchone()
+            # Item sem linha de estoque não é baixado pelo UPDATE: desfaz o pedido inteiro
+            if not estoque_ok:
+                raise EstoqueInsuficiente()
+        
+        atualizar_faturamento_mensal()
+        get_pedidos.clear()
+        get_total_pedidos.clear()
+        get_dashboard_metricas.clear()
+        get_estoque.clear()
+        get_relatorios.clear()
+        get_graficos_dashboard.clear()
+        return pedido_id
+    except (CheckViolation, EstoqueInsuficiente):
+        st.error("Estoque insuficiente para um ou mais itens do pedido")
+        return None
     except Exception as e:
         st.error(f"Erro ao criar pedido: {e}")
         return None
 
-def get_pedidos():
-    if not conn:
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_pedidos(limit=PAGE_SIZE, before_id=None):
+    """Pedidos mais recentes primeiro; before_id continua a listagem a partir do último id exibido"""
+    if not pool:
         return []
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT p.id, c.nome as cliente_nome, e.nome as escola_nome,
+                   p.status, p.data_pedido, p.total, p.desconto,
+                   COALESCE((
+                       SELECT jsonb_agg(jsonb_build_object(
+                                  'produto', pr.nome, 'tamanho', i.tamanho,
+                                  'quantidade', i.quantidade, 'preco', i.preco_unitario
+                              ) ORDER BY i.id)
+                       FROM itens_pedido i
+                       JOIN produtos pr ON i.produto_id = pr.id
+                       WHERE i.pedido_id = p.id
+                   ), '[]') as itens
+            FROM pedidos p
+            JOIN clientes c ON p.cliente_id = c.id
+            JOIN escolas e ON p.escola_id = e.id
+            WHERE %(before_id)s::int IS NULL OR p.id < %(before_id)s::int
+            ORDER BY p.id DESC
+            LIMIT %(limit)s
+        """, {'before_id': before_id, 'limit': limit})
+        return [Pedido(*row) for row in cur.fetchall()]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_total_pedidos():
+    if not pool:
+        return 0
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*)
+            FROM pedidos p
+            JOIN clientes c ON p.cliente_id = c.id
+            JOIN escolas e ON p.escola_id = e.id
+        """)
+        return cur.fetchone()[0]
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_dashboard_metricas():
+    """Retorna (clientes, escolas, pedidos pendentes, faturamento de hoje) em uma única consulta"""
+    if not pool:
+        return 0, 0, 0, 0
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT COUNT(*) FROM clientes),
+                   (SELECT COUNT(*) FROM escolas),
+                   (SELECT COUNT(*) FROM pedidos WHERE status = 'Pendente'),
+                   (SELECT COALESCE(SUM(total), 0) FROM pedidos WHERE data_pedido = CURRENT_DATE)
+        """)
+        return cur.fetchone()
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_graficos_dashboard():
+    """Pedidos por status e faturamento mensal em uma única consulta"""
+    por_status = {'status': [], 'count': []}
+    mensal = {'mes': [], 'total': []}
+    if not pool:
+        return por_status, mensal
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT 'status' as tipo, status as chave, COUNT(*)::numeric as valor
+            FROM pedidos 
+            GROUP BY status
+            UNION ALL
+            SELECT 'mes', TO_CHAR(mes, 'YYYY-MM'), total
+            FROM faturamento_mensal
+            ORDER BY 1, 2
+        """)
+        for tipo, chave, valor in cur.fetchall():
+            if tipo == 'status':
+                por_status['status'].append(chave)
+                por_status['count'].append(int(valor))
+            else:
+                mensal['mes'].append(chave)
+                mensal['total'].append(float(valor))
+    return por_status, mensal
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_relatorios(n=10):
+    """Estoque por escola e produto e os n produtos mais vendidos, em colunas e em uma única consulta"""
+    estoque = {'escola_nome': [], 'produto_nome': [], 'quantidade': []}
+    top = {'nome': [], 'total_vendido': []}
+    if not pool:
+        return estoque, top
+    with get_conn() as conn, conn.cursor() as cur:
+        # Instrução preparada uma vez por conexão do pool; reexecuções pulam parse e planejamento.
+        # As duas agregações voltam como objetos json de colunas em uma só ida ao banco.
+        if conn not in conexoes_preparadas:
             cur.execute("""
-                SELECT p.*, c.nome as cliente_nome, e.nome as escola_nome
-                FROM pedidos p
-                JOIN clientes c ON p.cliente_id = c.id
-                JOIN escolas e ON p.escola_id = e.id
-                ORDER BY p.created_at DESC
+                PREPARE relatorios(int) AS
+                SELECT
+                    (SELECT json_build_object(
+                                'escola_nome', COALESCE(json_agg(escola_nome ORDER BY escola_nome, produto_nome), '[]'),
+                                'produto_nome', COALESCE(json_agg(produto_nome ORDER BY escola_nome, produto_nome), '[]'),
+                                'quantidade', COALESCE(json_agg(quantidade ORDER BY escola_nome, produto_nome), '[]'))
+                     FROM (
+                         SELECT esc.nome as escola_nome, p.nome as produto_nome, SUM(e.quantidade) as quantidade
+                         FROM estoque e
+                         JOIN produtos p ON e.produto_id = p.id
+                         JOIN escolas esc ON e.escola_id = esc.id
+                         GROUP BY esc.nome, p.nome
+                     ) s),
+                    (SELECT json_build_object(
+                                'nome', COALESCE(json_agg(nome ORDER BY total_vendido DESC, nome), '[]'),
+                                'total_vendido', COALESCE(json_agg(total_vendido ORDER BY total_vendido DESC, nome), '[]'))
+                     FROM (
+                         SELECT p.nome, SUM(i.quantidade)::int as total_vendido
+                         FROM itens_pedido i
+                         JOIN produtos p ON i.produto_id = p.id
+                         GROUP BY p.id, p.nome
+                         ORDER BY total_vendido DESC, p.nome
+                         LIMIT $1
+                     ) t)
             """)
-            return cur.fetchall()
+            conn.commit()
+            conexoes_preparadas.add(conn)
+        cur.execute("EXECUTE relatorios(%s)", (n,))
+        return cur.fetchone()
+
+# As consultas em cache deixam o erro subir, para que uma falha não fique em cache
+# e não seja repetida para todas as sessões; quem chama exibe o erro só nesta sessão
+def consultar(consulta, *args, padrao):
+    """Executa uma consulta em cache; se o banco falhar, exibe o erro e devolve padrao"""
+    try:
+        return consulta(*args)
     except Exception as e:
-        st.error(f"Erro ao buscar pedidos: {e}")
-        return []
+        st.error(f"Erro ao consultar o banco de dados: {e}")
+        return padrao
 
-# Funções para gráficos sem pandas
-def prepare_pie_chart_data(data, value_col, name_col):
-    """Prepara dados para gráfico de pizza"""
-    values = [item[value_col] for item in data]
-    names = [item[name_col] for item in data]
-    return names, values
-
-def prepare_line_chart_data(data, x_col, y_col):
-    """Prepara dados para gráfico de linha"""
-    x = [item[x_col] for item in data]
-    y = [float(item[y_col]) for item in data]
-    return x, y
-
-def prepare_bar_chart_data(data, x_col, y_col, color_col=None):
-    """Prepara dados para gráfico de barras"""
-    x = [item[x_col] for item in data]
-    y = [item[y_col] for item in data]
-    color = [item[color_col] for item in data] if color_col else None
-    return x, y, color
+# Paginação das listagens
+def paginar(total, key):
+    """Exibe o seletor de página e retorna o offset correspondente"""
+    paginas = max(1, -(-total // PAGE_SIZE))
+    pagina = min(st.number_input("Página", min_value=1, step=1, value=1, key=key), paginas)
+    st.caption(f"Página {pagina} de {paginas} ({total} registros)")
+    return (pagina - 1) * PAGE_SIZE
 
 # Interface de Login
 def show_login():
@@ -510,132 +952,67 @@ def main():
         show_reports()
 
 def show_dashboard():
-    if not conn:
+    if not pool:
         st.error("⚠️ Banco de dados não conectado. Algumas informações podem não estar disponíveis.")
         return
     
+    total_clientes, total_escolas, pedidos_pendentes, faturamento_hoje = consultar(get_dashboard_metricas, padrao=(0, 0, 0, 0))
+    
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM clientes")
-                total_clientes = cur.fetchone()[0]
-            st.markdown(f"""
-                <div class="metric-card">
-                    <h3>👥 Total Clientes</h3>
-                    <h2>{total_clientes}</h2>
-                </div>
-            """, unsafe_allow_html=True)
-        except:
-            st.markdown("""
-                <div class="metric-card">
-                    <h3>👥 Total Clientes</h3>
-                    <h2>0</h2>
-                </div>
-            """, unsafe_allow_html=True)
+        st.markdown(f"""
+            <div class="metric-card">
+                <h3>👥 Total Clientes</h3>
+                <h2>{total_clientes}</h2>
+            </div>
+        """, unsafe_allow_html=True)
     
     with col2:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM escolas")
-                total_escolas = cur.fetchone()[0]
-            st.markdown(f"""
-                <div class="metric-card">
-                    <h3>🏫 Total Escolas</h3>
-                    <h2>{total_escolas}</h2>
-                </div>
-            """, unsafe_allow_html=True)
-        except:
-            st.markdown("""
-                <div class="metric-card">
-                    <h3>🏫 Total Escolas</h3>
-                    <h2>0</h2>
-                </div>
-            """, unsafe_allow_html=True)
+        st.markdown(f"""
+            <div class="metric-card">
+                <h3>🏫 Total Escolas</h3>
+                <h2>{total_escolas}</h2>
+            </div>
+        """, unsafe_allow_html=True)
     
     with col3:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM pedidos WHERE status = 'Pendente'")
-                pedidos_pendentes = cur.fetchone()[0]
-            st.markdown(f"""
-                <div class="metric-card">
-                    <h3>📦 Pedidos Pendentes</h3>
-                    <h2>{pedidos_pendentes}</h2>
-                </div>
-            """, unsafe_allow_html=True)
-        except:
-            st.markdown("""
-                <div class="metric-card">
-                    <h3>📦 Pedidos Pendentes</h3>
-                    <h2>0</h2>
-                </div>
-            """, unsafe_allow_html=True)
+        st.markdown(f"""
+            <div class="metric-card">
+                <h3>📦 Pedidos Pendentes</h3>
+                <h2>{pedidos_pendentes}</h2>
+            </div>
+        """, unsafe_allow_html=True)
     
     with col4:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT SUM(total) FROM pedidos WHERE data_pedido = CURRENT_DATE")
-                result = cur.fetchone()[0]
-                faturamento_hoje = result if result else 0
-            st.markdown(f"""
-                <div class="metric-card">
-                    <h3>💰 Faturamento Hoje</h3>
-                    <h2>R$ {faturamento_hoje:,.2f}</h2>
-                </div>
-            """, unsafe_allow_html=True)
-        except:
-            st.markdown("""
-                <div class="metric-card">
-                    <h3>💰 Faturamento Hoje</h3>
-                    <h2>R$ 0,00</h2>
-                </div>
-            """, unsafe_allow_html=True)
+        st.markdown(f"""
+            <div class="metric-card">
+                <h3>💰 Faturamento Hoje</h3>
+                <h2>R$ {faturamento_hoje:,.2f}</h2>
+            </div>
+        """, unsafe_allow_html=True)
     
     # Gráficos
+    por_status, mensal = consultar(get_graficos_dashboard, padrao=({'status': [], 'count': []},
+                                                                  {'mes': [], 'total': []}))
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Pedidos por Status")
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT status, COUNT(*) as count 
-                    FROM pedidos 
-                    GROUP BY status
-                """)
-                data = cur.fetchall()
-            if data:
-                names, values = prepare_pie_chart_data(data, 'count', 'status')
-                fig = px.pie(values=values, names=names, hole=0.3)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Nenhum dado disponível para o gráfico")
-        except Exception as e:
-            st.error(f"Erro ao carregar gráfico: {e}")
+        if por_status['status']:
+            fig = go.Figure(go.Pie(values=por_status['count'], labels=por_status['status'], hole=0.3))
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Nenhum dado disponível para o gráfico")
     
     with col2:
         st.subheader("Faturamento Mensal")
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT DATE_TRUNC('month', data_pedido) as mes, 
-                           SUM(total) as total 
-                    FROM pedidos 
-                    GROUP BY mes 
-                    ORDER BY mes
-                """)
-                data = cur.fetchall()
-            if data:
-                x, y = prepare_line_chart_data(data, 'mes', 'total')
-                fig = px.line(x=x, y=y, title='Evolução do Faturamento')
-                fig.update_layout(xaxis_title='Mês', yaxis_title='Total (R$)')
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Nenhum dado disponível para o gráfico")
-        except Exception as e:
-            st.error(f"Erro ao carregar gráfico: {e}")
+        if mensal['mes']:
+            fig = go.Figure(go.Scatter(x=mensal['mes'], y=mensal['total'], mode='lines'))
+            fig.update_layout(title='Evolução do Faturamento', xaxis_title='Mês', yaxis_title='Total (R$)')
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Nenhum dado disponível para o gráfico")
 
 def show_escolas_management():
     st.header("🏫 Gestão de Escolas")
@@ -660,86 +1037,129 @@ def show_escolas_management():
                     st.error("Nome é obrigatório")
     
     with tab2:
-        escolas = get_escolas()
+        escolas = consultar(get_escolas, padrao=[])
         if escolas:
-            for escola in escolas:
-                col1, col2, col3 = st.columns([3, 2, 1])
-                with col1:
-                    st.write(f"**{escola['nome']}**")
-                    st.write(f"📞 {escola['telefone']} | 📧 {escola['email']}")
-                with col2:
-                    st.write(f"🏠 {escola['endereco']}")
-                with col3:
-                    if st.button("Excluir", key=f"del_esc_{escola['id']}"):
-                        try:
-                            with conn.cursor() as cur:
-                                cur.execute("DELETE FROM escolas WHERE id = %s", (escola['id'],))
-                                conn.commit()
-                            st.success("Escola excluída com sucesso!")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Erro ao excluir escola: {e}")
+            _, nomes, telefones, emails, enderecos = zip(*escolas)
+            st.dataframe({
+                'Nome': list(nomes),
+                'Telefone': list(telefones),
+                'Email': list(emails),
+                'Endereço': list(enderecos),
+            }, use_container_width=True, hide_index=True)
+            
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                selecionadas = st.multiselect("Excluir escolas", escolas, format_func=lambda x: x.nome,
+                                              key='excluir_escolas')
+            with col2:
+                if st.button("Excluir", key='del_esc', disabled=not selecionadas):
+                    try:
+                        with db_tx() as cur:
+                            cur.execute("DELETE FROM escolas WHERE id = ANY(%s)", ([e.id for e in selecionadas],))
+                        get_escolas.clear()
+                        get_escolas_index.clear()
+                        get_dashboard_metricas.clear()
+                        get_clientes.clear()
+                        get_clientes_index.clear()
+                        st.success(f"{len(selecionadas)} escola(s) excluída(s) com sucesso!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erro ao excluir escola: {e}")
         else:
             st.info("Nenhuma escola cadastrada")
 
+@st.fragment
+def _cadastro_cliente_fragment():
+    """Formulário de cadastro de cliente"""
+    # Consultas (em cache) fora do formulário; dentro dele só há widgets
+    escolas, escola_nomes = consultar(get_escolas_index, padrao=([], ()))
+    with st.form("cadastro_cliente"):
+        nome = st.text_input("Nome Completo*")
+        telefone = st.text_input("Telefone")
+        email = st.text_input("Email")
+        cpf = st.text_input("CPF (opcional)")  # CPF não é mais obrigatório
+        endereco = st.text_area("Endereço")
+        
+        if escolas:
+            escola_id = escolas[st.selectbox("Escola", range(len(escolas)), format_func=escola_nomes.__getitem__)].id
+        else:
+            st.warning("Cadastre uma escola primeiro")
+            escola_id = None
+        
+        if st.form_submit_button("Cadastrar Cliente"):
+            if nome and escola_id:  # Apenas nome e escola são obrigatórios
+                if add_cliente(nome, telefone, email, cpf, endereco, escola_id):
+                    st.success("Cliente cadastrada com sucesso!")
+                    st.rerun()
+                else:
+                    st.error("Erro ao cadastrar cliente")
+            else:
+                st.error("Nome e Escola são obrigatórios")
+
 def show_clientes_management():
     st.header("👥 Gestão de Clientes")
     
     tab1, tab2 = st.tabs(["Cadastrar Cliente", "Lista de Clientes"])
     
     with tab1:
-        with st.form("cadastro_cliente"):
-            nome = st.text_input("Nome Completo*")
-            telefone = st.text_input("Telefone")
-            email = st.text_input("Email")
-            cpf = st.text_input("CPF (opcional)")  # CPF não é mais obrigatório
-            endereco = st.text_area("Endereço")
-            
-            escolas = get_escolas()
-            if escolas:
-                escola_opcoes = {e['nome']: e['id'] for e in escolas}
-                escola_selecionada = st.selectbox("Escola", list(escola_opcoes.keys()))
-            else:
-                st.warning("Cadastre uma escola primeiro")
-                escola_opcoes = {}
-                escola_selecionada = None
-            
-            if st.form_submit_button("Cadastrar Cliente"):
-                if nome and escola_selecionada:  # Apenas nome e escola são obrigatórios
-                    escola_id = escola_opcoes[escola_selecionada]
-                    if add_cliente(nome, telefone, email, cpf, endereco, escola_id):
-                        st.success("Cliente cadastrada com sucesso!")
-                        st.rerun()
-                    else:
-                        st.error("Erro ao cadastrar cliente")
-                else:
-                    st.error("Nome e Escola são obrigatórios")
+        _cadastro_cliente_fragment()
     
     with tab2:
-        clientes = get_clientes()
+        offset = paginar(consultar(get_total_clientes, padrao=0), 'pagina_clientes')
+        clientes = consultar(get_clientes, PAGE_SIZE, offset, padrao=[])
         if clientes:
-            for cliente in clientes:
-                col1, col2, col3 = st.columns([3, 2, 1])
-                with col1:
-                    st.write(f"**{cliente['nome']}**")
-                    st.write(f"📞 {cliente['telefone']} | 📧 {cliente['email']}")
-                    st.write(f"🎓 {cliente['escola_nome']}")
-                with col2:
-                    st.write(f"📍 {cliente['endereco']}")
-                    st.write(f"🔢 CPF: {cliente['cpf'] or 'Não informado'}")
-                with col3:
-                    if st.button("Excluir", key=f"del_cli_{cliente['id']}"):
-                        try:
-                            with conn.cursor() as cur:
-                                cur.execute("DELETE FROM clientes WHERE id = %s", (cliente['id'],))
-                                conn.commit()
-                            st.success("Cliente excluído com sucesso!")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Erro ao excluir cliente: {e}")
+            ids, nomes, telefones, emails, cpfs, enderecos, escolas_nomes = zip(*clientes)
+            st.dataframe({
+                'Nome': list(nomes),
+                'Telefone': list(telefones),
+                'Email': list(emails),
+                'Escola': list(escolas_nomes),
+                'Endereço': list(enderecos),
+                'CPF': [cpf or 'Não informado' for cpf in cpfs],
+            }, use_container_width=True, hide_index=True)
+            
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                nome_por_id = dict(zip(ids, nomes))
+                selecionados = st.multiselect("Excluir clientes", ids, format_func=nome_por_id.get,
+                                              key='excluir_clientes')
+            with col2:
+                if st.button("Excluir", key='del_cli', disabled=not selecionados):
+                    try:
+                        with db_tx() as cur:
+                            cur.execute("DELETE FROM clientes WHERE id = ANY(%s)", (list(selecionados),))
+                        get_clientes.clear()
+                        get_clientes_index.clear()
+                        get_total_clientes.clear()
+                        get_dashboard_metricas.clear()
+                        st.success(f"{len(selecionados)} cliente(s) excluído(s) com sucesso!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erro ao excluir cliente: {e}")
         else:
             st.info("Nenhum cliente cadastrado")
 
+@st.fragment
+def _gerenciar_estoque_fragment():
+    """Formulário de atualização de estoque"""
+    escolas, escola_nomes = consultar(get_escolas_index, padrao=([], ()))
+    produtos, produto_nomes = consultar(get_produtos_index, padrao=([], ()))
+    
+    with st.form("gerenciar_estoque"):
+        if escolas and produtos:
+            escola_id = escolas[st.selectbox("Escola", range(len(escolas)), format_func=escola_nomes.__getitem__)].id
+            produto_id = produtos[st.selectbox("Produto", range(len(produtos)), format_func=produto_nomes.__getitem__)].id
+            tamanho_selecionado = st.selectbox("Tamanho", TAMANHOS)
+            quantidade = st.number_input("Quantidade", min_value=0, step=1, value=0)
+            
+            if st.form_submit_button("Atualizar Estoque"):
+                if update_estoque([(escola_id, produto_id, tamanho_selecionado, quantidade)]):
+                    st.success("Estoque atualizado com sucesso!")
+                else:
+                    st.error("Erro ao atualizar estoque")
+        else:
+            st.warning("Cadastre escolas e produtos primeiro")
+
 def show_estoque_management():
     st.header("📦 Gestão de Produtos e Estoque")
     
@@ -763,167 +1183,194 @@ def show_estoque_management():
                     st.error("Nome é obrigatório")
     
     with tab2:
-        with st.form("gerenciar_estoque"):
-            escolas = get_escolas()
-            produtos = get_produtos()
-            tamanhos = ['2', '4', '6', '8', '10', '12', 'pp', 'p', 'm', 'g', 'gg']
-            
-            if escolas and produtos:
-                escola_selecionada = st.selectbox("Escola", escolas, format_func=lambda x: x['nome'])
-                produto_selecionado = st.selectbox("Produto", produtos, format_func=lambda x: x['nome'])
-                tamanho_selecionado = st.selectbox("Tamanho", tamanhos)
-                quantidade = st.number_input("Quantidade", min_value=0, step=1, value=0)
-                
-                if st.form_submit_button("Atualizar Estoque"):
-                    if update_estoque(escola_selecionada['id'], produto_selecionado['id'], 
-                                 tamanho_selecionado, quantidade):
-                        st.success("Estoque atualizado com sucesso!")
-                    else:
-                        st.error("Erro ao atualizar estoque")
-            else:
-                st.warning("Cadastre escolas e produtos primeiro")
+        _gerenciar_estoque_fragment()
     
     with tab3:
-        estoque = get_estoque()
+        escolas, escola_nomes = consultar(get_escolas_index, padrao=([], ()))
+        opcoes = ("Todas", *escola_nomes)
+        indice = st.selectbox("Filtrar por escola", range(len(opcoes)), format_func=opcoes.__getitem__,
+                              key='filtro_estoque')
+        escola_filtro = escolas[indice - 1].id if indice else None
+        offset = paginar(consultar(get_total_estoque, escola_filtro, padrao=0), f'pagina_estoque_{escola_filtro}')
+        estoque = consultar(get_estoque, escola_filtro, PAGE_SIZE, offset, padrao=[])
         if estoque:
             st.subheader("Estoque por Escola")
-            # Agrupar por escola para melhor visualização
-            escolas_estoque = {}
-            for item in estoque:
-                escola_nome = item['escola_nome']
-                if escola_nome not in escolas_estoque:
-                    escolas_estoque[escola_nome] = []
-                escolas_estoque[escola_nome].append(item)
-            
-            for escola_nome, itens in escolas_estoque.items():
+            # Uma tabela por escola, já agrupada pelo banco (paginação por escola)
+            for escola_nome, itens in estoque:
                 with st.expander(f"🏫 {escola_nome}"):
-                    for item in itens:
-                        col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
-                        with col1:
-                            st.write(f"**{item['produto_nome']}**")
-                        with col2:
-                            st.write(f"Tamanho: {item['tamanho']}")
-                        with col3:
-                            st.write(f"Preço: R$ {item['preco_venda']:.2f}")
-                        with col4:
-                            cor = "red" if item['quantidade'] == 0 else "orange" if item['quantidade'] < 10 else "green"
-                            st.markdown(f"<span style='color: {cor}; font-weight: bold;'>Qtd: {item['quantidade']}</span>", 
-                                      unsafe_allow_html=True)
+                    st.dataframe(itens, use_container_width=True, hide_index=True,
+                                 column_config={'Preço': st.column_config.NumberColumn(format="R$ %.2f")})
         else:
             st.info("Nenhum item em estoque")
 
+@st.fragment
+def _novo_pedido_fragment():
+    """Formulário de criação de pedido"""
+    # As opções são índices; os nomes vêm de tuplas em cache e o registro é lido pela posição
+    clientes, cliente_nomes = consultar(get_clientes_index, padrao=([], ()))
+    produtos, produto_nomes = consultar(get_produtos_index, padrao=([], ()))
+    escolas, escola_nomes = consultar(get_escolas_index, padrao=([], ()))
+    
+    with st.form("novo_pedido"):
+        if clientes and produtos and escolas:
+            cliente = clientes[st.selectbox("Cliente", range(len(clientes)), format_func=cliente_nomes.__getitem__)]
+            escola = escolas[st.selectbox("Escola", range(len(escolas)), format_func=escola_nomes.__getitem__)]
+            desconto = st.number_input("Desconto (R$)", min_value=0.0, step=0.01, value=0.0)
+            
+            st.subheader("Itens do Pedido")
+            col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+            
+            with col1:
+                produto = produtos[st.selectbox("Produto", range(len(produtos)), format_func=produto_nomes.__getitem__,
+                                                key='produto_pedido')]
+            with col2:
+                tamanho = st.selectbox("Tamanho", TAMANHOS, key='tamanho_pedido')
+            with col3:
+                quantidade = st.number_input("Quantidade", min_value=1, step=1, value=1, key='quantidade_pedido')
+            with col4:
+                preco_unitario = st.number_input("Preço Unitário", min_value=0.0, step=0.01, 
+                                               value=float(produto.preco_venda or 0), 
+                                               key='preco_pedido')
+            
+            if st.form_submit_button("Criar Pedido"):
+                itens = [{
+                    'produto_id': produto.id,
+                    'tamanho': tamanho,
+                    'quantidade': quantidade,
+                    'preco_unitario': preco_unitario
+                }]
+                
+                pedido_id = criar_pedido(cliente.id, escola.id, itens, desconto)
+                if pedido_id:
+                    st.success(f"Pedido #{pedido_id} criado com sucesso!")
+                else:
+                    st.error("Erro ao criar pedido")
+        else:
+            st.warning("Cadastre clientes, produtos e escolas primeiro")
+
 def show_pedidos_management():
     st.header("📦 Gestão de Pedidos")
     
     tab1, tab2 = st.tabs(["Novo Pedido", "Histórico de Pedidos"])
     
     with tab1:
-        with st.form("novo_pedido"):
-            clientes = get_clientes()
-            produtos = get_produtos()
-            escolas = get_escolas()
-            tamanhos = ['2', '4', '6', '8', '10', '12', 'pp', 'p', 'm', 'g', 'gg']
-            
-            if clientes and produtos and escolas:
-                cliente_selecionado = st.selectbox("Cliente", clientes, format_func=lambda x: x['nome'])
-                escola_selecionada = st.selectbox("Escola", escolas, format_func=lambda x: x['nome'])
-                desconto = st.number_input("Desconto (R$)", min_value=0.0, step=0.01, value=0.0)
-                
-                st.subheader("Itens do Pedido")
-                col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
-                
-                with col1:
-                    produto = st.selectbox("Produto", produtos, format_func=lambda x: x['nome'], key='produto_pedido')
-                with col2:
-                    tamanho = st.selectbox("Tamanho", tamanhos, key='tamanho_pedido')
-                with col3:
-                    quantidade = st.number_input("Quantidade", min_value=1, step=1, value=1, key='quantidade_pedido')
-                with col4:
-                    preco_unitario = st.number_input("Preço Unitário", min_value=0.0, step=0.01, 
-                                                   value=float(produto['preco_venda']) if produto else 0.0, 
-                                                   key='preco_pedido')
-                
-                if st.form_submit_button("Criar Pedido"):
-                    itens = [{
-                        'produto_id': produto['id'],
-                        'tamanho': tamanho,
-                        'quantidade': quantidade,
-                        'preco_unitario': preco_unitario
-                    }]
-                    
-                    pedido_id = criar_pedido(cliente_selecionado['id'], escola_selecionada['id'], itens, desconto)
-                    if pedido_id:
-                        st.success(f"Pedido #{pedido_id} criado com sucesso!")
-                    else:
-                        st.error("Erro ao criar pedido")
-            else:
-                st.warning("Cadastre clientes, produtos e escolas primeiro")
+        _novo_pedido_fragment()
     
     with tab2:
-        pedidos = get_pedidos()
+        # Paginação por chave: cada página começa depois do último id da anterior (sem OFFSET).
+        # Só o número de páginas fica na sessão; os limites são refeitos a cada render.
+        if 'pedidos_paginas' not in st.session_state:
+            st.session_state.pedidos_paginas = 1
+        pedidos = []
+        before_id = None
+        for _ in range(st.session_state.pedidos_paginas):
+            pagina = consultar(get_pedidos, PAGE_SIZE, before_id, padrao=[])
+            pedidos += pagina
+            if len(pagina) < PAGE_SIZE:
+                break
+            before_id = pagina[-1].id
+        total_pedidos = consultar(get_total_pedidos, padrao=0)
+        st.caption(f"{len(pedidos)} de {total_pedidos} pedidos")
         if pedidos:
-            for pedido in pedidos:
-                with st.expander(f"Pedido #{pedido['id']} - {pedido['cliente_nome']} - R$ {pedido['total']:.2f}"):
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.write(f"**Cliente:** {pedido['cliente_nome']}")
-                        st.write(f"**Escola:** {pedido['escola_nome']}")
-                    with col2:
-                        st.write(f"**Status:** {pedido['status']}")
-                        st.write(f"**Data:** {pedido['data_pedido']}")
-                    with col3:
-                        st.write(f"**Total:** R$ {pedido['total']:.2f}")
-                        st.write(f"**Desconto:** R$ {pedido['desconto']:.2f}")
-                    
-                    if st.button("Excluir Pedido", key=f"del_ped_{pedido['id']}"):
-                        try:
-                            with conn.cursor() as cur:
-                                cur.execute("DELETE FROM pedidos WHERE id = %s", (pedido['id'],))
-                                conn.commit()
-                            st.success("Pedido excluído com sucesso!")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Erro ao excluir pedido: {e}")
+            # Uma única tabela para a página inteira; a coluna "Excluir" marca os pedidos a remover
+            ids, clientes_nomes, escolas_nomes, status, datas, totais, descontos, itens = zip(*pedidos)
+            editado = st.data_editor({
+                'Excluir': [False] * len(ids),
+                'Pedido': list(ids),
+                'Cliente': list(clientes_nomes),
+                'Escola': list(escolas_nomes),
+                'Status': list(status),
+                'Data': list(datas),
+                'Total': [float(total) for total in totais],
+                'Desconto': [float(desconto) for desconto in descontos],
+                'Itens': ["; ".join(f"{item['produto']} ({item['tamanho']}): {item['quantidade']} x R$ {item['preco']:.2f}"
+                                    for item in itens_pedido) for itens_pedido in itens],
+            }, use_container_width=True, hide_index=True,
+               disabled=['Pedido', 'Cliente', 'Escola', 'Status', 'Data', 'Total', 'Desconto', 'Itens'],
+               column_config={
+                   'Excluir': st.column_config.CheckboxColumn(),
+                   'Total': st.column_config.NumberColumn(format="R$ %.2f"),
+                   'Desconto': st.column_config.NumberColumn(format="R$ %.2f"),
+               })
+            selecionados = [pedido_id for pedido_id, marcado in zip(ids, editado['Excluir']) if marcado]
+            
+            if st.button("Excluir", key='del_ped', disabled=not selecionados):
+                try:
+                    # Em uma única instrução: remove os itens, devolve as quantidades ao estoque
+                    # da escola do pedido e remove os pedidos
+                    with db_tx() as cur:
+                        cur.execute("""
+                            WITH itens AS (
+                                DELETE FROM itens_pedido WHERE pedido_id = ANY(%(ids)s)
+                                RETURNING pedido_id, produto_id, tamanho, quantidade
+                            ), devolucao AS (
+                                INSERT INTO estoque (escola_id, produto_id, tamanho, quantidade)
+                                SELECT p.escola_id, i.produto_id, i.tamanho, SUM(i.quantidade)
+                                FROM itens i
+                                JOIN pedidos p ON p.id = i.pedido_id
+                                GROUP BY p.escola_id, i.produto_id, i.tamanho
+                                ON CONFLICT (escola_id, produto_id, tamanho)
+                                DO UPDATE SET quantidade = estoque.quantidade + EXCLUDED.quantidade
+                            )
+                            DELETE FROM pedidos WHERE id = ANY(%(ids)s)
+                        """, {'ids': list(selecionados)})
+                    atualizar_faturamento_mensal()
+                    get_estoque.clear()
+                    get_total_estoque.clear()
+                    get_pedidos.clear()
+                    get_total_pedidos.clear()
+                    get_dashboard_metricas.clear()
+                    get_graficos_dashboard.clear()
+                    get_relatorios.clear()
+                    st.success(f"{len(selecionados)} pedido(s) excluído(s) com sucesso!")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Erro ao excluir pedido: {e}")
+            
+            if len(pedidos) < total_pedidos and st.button("Carregar mais", key='mais_pedidos'):
+                st.session_state.pedidos_paginas += 1
+                st.rerun()
         else:
             st.info("Nenhum pedido cadastrado")
 
+# cache_resource devolve o mesmo objeto; cache_data recriaria (e validaria) a figura a cada acerto
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=False)
+def grafico_estoque_por_escola(estoque):
+    """Figura do estoque por escola; reruns com os mesmos dados reaproveitam a figura pronta"""
+    # Uma série de barras por produto, empilhadas por escola
+    series = {}
+    for escola_nome, produto_nome, quantidade in zip(estoque['escola_nome'], estoque['produto_nome'],
+                                                     estoque['quantidade']):
+        x, y = series.setdefault(produto_nome, ([], []))
+        x.append(escola_nome)
+        y.append(quantidade)
+    fig = go.Figure([go.Bar(x=x, y=y, name=produto_nome) for produto_nome, (x, y) in series.items()])
+    fig.update_layout(title="Estoque por Escola", barmode='stack',
+                      xaxis_title='Escola', yaxis_title='Quantidade', showlegend=True)
+    return fig
+
 def show_reports():
     st.header("📊 Relatórios e Análises")
     
+    estoque, top = consultar(get_relatorios, padrao=({'escola_nome': [], 'produto_nome': [], 'quantidade': []},
+                                                     {'nome': [], 'total_vendido': []}))
     col1, col2 = st.columns(2)
     
     with col1:
         st.subheader("Estoque por Escola")
-        estoque = get_estoque()
-        if estoque:
-            x, y, color = prepare_bar_chart_data(estoque, 'escola_nome', 'quantidade', 'produto_nome')
-            fig = px.bar(x=x, y=y, color=color, title="Estoque por Escola")
-            fig.update_layout(xaxis_title='Escola', yaxis_title='Quantidade', showlegend=True)
-            st.plotly_chart(fig, use_container_width=True)
+        if estoque['escola_nome']:
+            st.plotly_chart(grafico_estoque_por_escola(estoque), use_container_width=True)
         else:
             st.info("Nenhum dado disponível para o gráfico")
     
     with col2:
         st.subheader("Top Produtos")
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT p.nome, SUM(i.quantidade) as total_vendido
-                    FROM itens_pedido i
-                    JOIN produtos p ON i.produto_id = p.id
-                    GROUP BY p.id, p.nome
-                    ORDER BY total_vendido DESC
-                    LIMIT 10
-                """)
-                data = cur.fetchall()
-            if data:
-                names, values = prepare_pie_chart_data(data, 'total_vendido', 'nome')
-                fig = px.pie(values=values, names=names, title="Top Produtos Vendidos")
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Nenhum dado disponível para o gráfico")
-        except Exception as e:
-            st.error(f"Erro ao carregar gráfico: {e}")
+        if top['nome']:
+            fig = go.Figure(go.Pie(values=top['total_vendido'], labels=top['nome']))
+            fig.update_layout(title="Top Produtos Vendidos")
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Nenhum dado disponível para o gráfico")
 
 # Verificação de login
 if 'logged_in' not in st.session_state:
@@ -940,20 +1387,9 @@ else:
             st.rerun()
     
     # Status da conexão
-    if conn:
+    if pool:
         st.sidebar.success("✅ Conectado ao PostgreSQL")
     else:
         st.sidebar.error("❌ Banco não conectado")
     
     main()
-
-# Criar usuário admin padrão se não existir
-try:
-    if conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM usuarios WHERE username = 'admin'")
-            if cur.fetchone()[0] == 0:
-                add_user('admin', 'admin123', 'Admin')
-                st.sidebar.info("Usuário admin criado: admin / admin123")
-except Exception as e:
-    st.sidebar.error(f"Erro ao criar usuário admin: {e}")
@@ -0,0 +1,9 @@
+# Linhas retornadas pelas consultas (tuplas nomeadas em vez de um dict por linha).
+# Ficam fora de app.py porque o Streamlit recria o módulo __main__ a cada execução
+# do script, e o st.cache_data precisa encontrar sempre a mesma classe ao serializar.
+from collections import namedtuple
+
+Escola = namedtuple('Escola', 'id nome telefone email endereco')
+Produto = namedtuple('Produto', 'id nome preco_venda')
+Cliente = namedtuple('Cliente', 'id nome telefone email cpf endereco escola_nome')
+Pedido = namedtuple('Pedido', 'id cliente_nome escola_nome status data_pedido total desconto itens')